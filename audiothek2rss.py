@@ -5,14 +5,62 @@
 # LICENSE file in the same directory of this source tree.
 
 import os, sys
+import asyncio
 import requests
+from requests.adapters import HTTPAdapter
 import argparse
 import html
+import re
+import functools
+import itertools
 import unicodedata
 import shutil
 from datetime import datetime
-import xml.etree.ElementTree as ET
 from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+import xml.etree.ElementTree as ET
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import requests_cache
+except ImportError:
+    requests_cache = None
+
+API_URL = "https://api.ardaudiothek.de/graphql"
+API_HEADERS = {'Content-Type': 'application/json', 'Accept-Charset': 'UTF-8', 'Accept-Encoding': 'gzip, deflate'}
+API_TIMEOUT = 30
+CACHE_EXPIRATION = 3600
+NAMESPACES = {"atom": "http://www.w3.org/2005/Atom", 
+              "media": "http://search.yahoo.com/mrss/", 
+              "itunes": "http://www.itunes.com/dtds/podcast-1.0.dtd"}
+EPISODE_FRAGMENT = "fragment ProgramSetEpisodes on ProgramSet{title,path,synopsis,sharingUrl,image{url,url1X1,},items(orderBy:PUBLISH_DATE_DESC,filter:{isPublished:{equalTo:true}}first:$latest){nodes{title,summary,synopsis,sharingUrl,publicationStartDateAndTime:publishDate,url,episodeNumber,duration,image{url,url1X1,},isPublished,audios{url,downloadUrl,mimeType,}}}}"
+
+# characters not allowed in XML 1.0 documents
+INVALID_XML_CHARS = re.compile(r"[^\u0009\u000A\u000D\u0020-\uD7FF\uE000-\uFFFD\U00010000-\U0010FFFF]")
+
+# the image URLs repeat across the episodes of a program
+cachedEscape = functools.lru_cache(maxsize=4096)(html.escape)
+
+if etree is None:
+    # the pure Python fallback is many times slower than the C accelerator
+    if ET.Element is getattr(ET, "_Element_Py", None):
+        print("The C accelerator of xml.etree.ElementTree is not available, writing the RSS files will be slow.")
+    for prefix, uri in NAMESPACES.items():
+        ET.register_namespace(prefix, uri)
+
+@functools.lru_cache(maxsize=1024)
+def fixImageUrl(imageUrl):
+    return imageUrl.replace("{width}", "448") if imageUrl else None
 
 class AudiothekCategory(object):
     
@@ -28,10 +76,13 @@ class AudiothekCategory(object):
         self.programSets.extend(programSets)
         
 class AudiothekProgramSet(object):
+    __slots__ = ("id", "title", "normTitle", "initChar", "sharingUrl", "description", "synopsis", "rssPath", "audiothekPath", "imageUrl", "items")
     
     def __init__(self, id, title, sharingUrl="", description="", synopsis="", imageUrl=""):
         self.id = id
         self.title = title
+        self.normTitle = unicodedata.normalize("NFKD", title)
+        self.initChar = self.normTitle[:1].upper()
         self.sharingUrl = sharingUrl
         self.description = description
         self.synopsis = synopsis
@@ -53,42 +104,37 @@ class AudiothekProgramSet(object):
             item.programSet = self
     
     def queryEpisodes(self, options):
+        queryEpisodeBatch([self], options)
+    
+    def readEpisodes(self, data):
         episodes = []
-        query = "programSet(id:%d){title,path,synopsis,sharingUrl,image{url,url1X1,},items(orderBy:PUBLISH_DATE_DESC,filter:{isPublished:{equalTo:true}}first:%d){nodes{title,summary,synopsis,sharingUrl,publicationStartDateAndTime:publishDate,url,episodeNumber,duration,image{url,url1X1,},isPublished,audios{url,downloadUrl,mimeType,}}}}" % (int(self.id), options.latest)
-        data = executeQuery(query)["data"]["programSet"]
         for item in data["items"]["nodes"]:
             episodes.append(AudiothekItem(0, item["title"], item["duration"], item["publicationStartDateAndTime"], item["audios"][0]["url"], sharingUrl=item["sharingUrl"], description=item["summary"], synopsis=item["synopsis"], imageUrl=item["image"]["url1X1"]))
         self.addItems(episodes)
         self.imageUrl = data["image"]["url1X1"]
         self.audiothekPath = data["path"]
         
-    def toXML(self):
-        channel = ET.Element('channel')
-        showTitle = ET.SubElement(channel, 'title')
-        showTitle.text = html.escape(self.title)
-        showLink = ET.SubElement(channel, 'link')
-        showLink.text = self.sharingUrl
+    def toXML(self, builder):
+        builder.start('channel', {})
+        escapedTitle = html.escape(self.title)
+        addTextElement(builder, 'title', escapedTitle)
+        addTextElement(builder, 'link', self.sharingUrl)
         if self.imageUrl is not None:
-            showImage = ET.SubElement(channel, "image")
-            showImageUrl = ET.SubElement(showImage, "url")
-            showImageUrl.text = html.escape(self.imageUrl)
-            showImageTitle = ET.SubElement(showImage, "title")
-            showImageTitle.text = html.escape(self.title)
+            builder.start("image", {})
+            addTextElement(builder, "url", html.escape(self.imageUrl))
+            addTextElement(builder, "title", escapedTitle)
             if self.audiothekPath is not None:
-                showImageLink = ET.SubElement(showImage, "link")
-                showImageLink.text = "https://www.ardaudiothek.de%s" % self.audiothekPath
-        showDescription = ET.SubElement(channel, 'description')
-        showDescription.text = html.escape(self.synopsis)
-        atom = ET.SubElement(channel, "atom:link")
-        atom.set("href", "ardaudiothek.html")
-        atom.set("rel", "self")
-        atom.set("type", "application/rss+xml")
+                addTextElement(builder, "link", "https://www.ardaudiothek.de%s" % self.audiothekPath)
+            builder.end("image")
+        addTextElement(builder, 'description', html.escape(self.synopsis))
+        addTextElement(builder, "{%s}link" % NAMESPACES["atom"], None, {"href": "ardaudiothek.html", "rel": "self", "type": "application/rss+xml"})
         for item in self.items:
             if item.valid:
-                channel.append(item.toXML())
-        return channel
+                item.toXML(builder, escapedProgramSetTitle=escapedTitle)
+        builder.end('channel')
 
 class AudiothekItem(object):
+    __slots__ = ("id", "title", "dateTime", "duration", "downloadUrl", "sharingUrl", "description", "synopsis", "valid", "imageUrl", "programSet")
     
     def __init__(self, id, title, duration, dateTime, downloadUrl, sharingUrl="", description="", synopsis="", imageUrl=""):
         self.id = id
@@ -100,101 +146,278 @@ class AudiothekItem(object):
         self.description = description if len(description) > 0 else ""
         self.synopsis = synopsis if len(synopsis) > 0 else ""
         self.valid = self.downloadUrl is not None
-        self.imageUrl = imageUrl.replace("{width}", "448") if len(imageUrl) > 0 else None
+        self.imageUrl = fixImageUrl(imageUrl)
         self.programSet = None
         
-    def toXML(self):
-        item = ET.Element('item')
-        title = ET.SubElement(item, 'title')
-        title.text = html.escape(self.title)
-        description = ET.SubElement(item, 'description')
-        description.text = html.escape(self.synopsis)
-        guid = ET.SubElement(item, "guid")
-        guid.text = self.sharingUrl
-        link = ET.SubElement(item, "link")
-        link.text = self.sharingUrl
-        enclosure = ET.SubElement(item, "enclosure")
-        enclosure.set("url", self.downloadUrl)
-        enclosure.set("length", "")
-        enclosure.set("type", "audio/mpeg")
-        media = ET.SubElement(item, "media:content")
-        media.set("url", self.downloadUrl)
-        media.set("medium", "audio")
-        media.set("type", "audio/mpeg")
-        media.set("duration", str(self.duration))
-        pubDate = ET.SubElement(item, "pubDate")
-        pubDate.text = self.dateTime
-        itunes = ET.SubElement(item, "itunes:duration")
-        itunes.text = str(self.duration)
+    def toXML(self, builder, escapedProgramSetTitle=None):
+        builder.start('item', {})
+        addTextElement(builder, 'title', html.escape(self.title))
+        addTextElement(builder, 'description', html.escape(self.synopsis))
+        addTextElement(builder, "guid", self.sharingUrl)
+        addTextElement(builder, "link", self.sharingUrl)
+        addTextElement(builder, "enclosure", None, {"url": self.downloadUrl, "length": "", "type": "audio/mpeg"})
+        addTextElement(builder, "{%s}content" % NAMESPACES["media"], None, {"url": self.downloadUrl, "medium": "audio", "type": "audio/mpeg", "duration": str(self.duration)})
+        addTextElement(builder, "pubDate", self.dateTime)
+        addTextElement(builder, "{%s}duration" % NAMESPACES["itunes"], str(self.duration))
         if self.imageUrl:
-            image = ET.SubElement(item, "image")
-            imageUrl = ET.SubElement(image, "url")
-            imageUrl.text = html.escape(self.imageUrl)
-            imageTitle = ET.SubElement(image, "title")
-            if self.programSet is not None:
-                imageTitle.text = html.escape(self.programSet.title)
-            itunesImage = ET.SubElement(item, "itunes:image")
-            itunesImage.set("href", html.escape(self.imageUrl))
-        return item
-
-def executeQuery(query):
-    url = "https://api.ardaudiothek.de/graphql"
-    headers = {'Content-Type': 'application/json', 'Accept-Charset': 'UTF-8'}
-    obj = {"query": "{%s}" % (query)}
-    result = requests.post(url, json=obj, headers=headers)
-    data = result.json()
+            builder.start("image", {})
+            addTextElement(builder, "url", cachedEscape(self.imageUrl))
+            if escapedProgramSetTitle is not None:
+                addTextElement(builder, "title", escapedProgramSetTitle)
+            elif self.programSet is not None:
+                addTextElement(builder, "title", html.escape(self.programSet.title))
+            else:
+                addTextElement(builder, "title", None)
+            builder.end("image")
+            addTextElement(builder, "{%s}image" % NAMESPACES["itunes"], None, {"href": cachedEscape(self.imageUrl)})
+        builder.end('item')
+
+class XMLFileBuilder(object):
+    """ Offers the start/data/end interface of a TreeBuilder on top of lxml.etree.xmlfile to write the elements directly to the file """
+    
+    def __init__(self, xf, pretty=False):
+        self.xf = xf
+        self.pretty = pretty
+        self.elements = []
+        self.hasChildren = False
+        
+    def start(self, tag, attrs, nsmap=None):
+        # no whitespace outside the root element
+        if self.pretty and len(self.elements) > 0:
+            self.xf.write("\n" + "    " * len(self.elements))
+        element = self.xf.element(tag, attrs, nsmap=nsmap)
+        element.__enter__()
+        self.elements.append(element)
+        self.hasChildren = False
+        
+    def data(self, text):
+        self.xf.write(text)
+        
+    def end(self, tag):
+        element = self.elements.pop()
+        if self.pretty and self.hasChildren:
+            self.xf.write("\n" + "    " * len(self.elements))
+        element.__exit__(None, None, None)
+        self.hasChildren = True
+
+def addTextElement(builder, tag, text, attrib=None):
+    # lxml rejects control characters from the API texts
+    attrib = {} if attrib is None else {key: INVALID_XML_CHARS.sub("", value) for key, value in attrib.items()}
+    builder.start(tag, attrib)
+    if text is not None:
+        builder.data(INVALID_XML_CHARS.sub("", text))
+    builder.end(tag)
+
+_session = None
+
+def isCacheableResponse(response):
+    # GraphQL errors come with status 200 and must not be replayed from the cache
+    try:
+        data = response.json() if orjson is None else orjson.loads(response.content)
+    except ValueError:
+        return False
+    return isinstance(data, dict) and "errors" not in data and data.get("data") is not None
+
+def createSession(useCache=False):
+    if useCache and requests_cache is not None:
+        # cache the POST responses keyed by the query document and variables
+        session = requests_cache.CachedSession("audiothek2rss", use_cache_dir=True, 
+                                               expire_after=CACHE_EXPIRATION, 
+                                               allowable_methods=("GET", "POST"), 
+                                               cache_control=True, 
+                                               filter_fn=isCacheableResponse)
+    else:
+        session = requests.Session()
+    session.headers.update(API_HEADERS)
+    # keep enough connections alive for concurrent queries
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def getSession():
+    global _session
+    if _session is None:
+        _session = createSession()
+    return _session
+
+def initSession(options):
+    global _session
+    _session = createSession(useCache=options.cache)
+
+def executeQuery(query, variables=None):
+    obj = {"query": query, "variables": variables}
+    result = getSession().post(API_URL, json=obj, timeout=API_TIMEOUT)
+    data = result.json() if orjson is None else orjson.loads(result.content)
     return data
 
+async def executeQueryAsync(session, query, variables=None):
+    obj = {"query": query, "variables": variables}
+    async with session.post(API_URL, json=obj) as result:
+        data = await result.json() if orjson is None else orjson.loads(await result.read())
+    return data
+
+def splitIntoBatches(values, batchSize):
+    return [values[i:i + batchSize] for i in range(0, len(values), batchSize)]
+
+def buildBatchedEpisodeQuery(programSets, latest):
+    # one aliased selection per program set sharing the same fragment
+    variables = {"latest": latest}
+    declarations = ["$latest:Int!"]
+    selections = []
+    for i, programSet in enumerate(programSets):
+        variables["id%d" % i] = str(programSet.id)
+        declarations.append("$id%d:ID!" % i)
+        selections.append("ps%d:programSet(id:$id%d){...ProgramSetEpisodes}" % (i, i))
+    query = "query(" + ",".join(declarations) + "){" + "".join(selections) + "}" + EPISODE_FRAGMENT
+    return query, variables
+
+def readEpisodeBatch(programSets, data):
+    # a single unknown program set must not discard the rest of the batch
+    if data is None:
+        data = {}
+    for i, programSet in enumerate(programSets):
+        programSetData = data.get("ps%d" % i)
+        if programSetData is None:
+            print("Could not query the episodes of program %d" % int(programSet.id))
+            continue
+        programSet.readEpisodes(programSetData)
+
+def reportFailedEpisodeBatch(programSets, error):
+    for programSet in programSets:
+        print("Could not query the episodes of program %d: %s" % (int(programSet.id), error))
+
+def queryEpisodeBatch(programSets, options):
+    # a failed request must not discard the episodes of the other batches
+    try:
+        data = executeQuery(*buildBatchedEpisodeQuery(programSets, options.latest)).get("data")
+    except (requests.RequestException, ValueError) as error:
+        reportFailedEpisodeBatch(programSets, error)
+        return
+    readEpisodeBatch(programSets, data)
+
+async def queryEpisodeBatchAsync(session, programSets, options):
+    try:
+        data = (await executeQueryAsync(session, *buildBatchedEpisodeQuery(programSets, options.latest))).get("data")
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as error:
+        reportFailedEpisodeBatch(programSets, error)
+        return
+    readEpisodeBatch(programSets, data)
+
 def getCategories(options):
     categories = []
     if options.categoryID is None and options.categorySearch is None:
         return categories
     elif options.categoryID is not None:
-        query = "editorialCategoriesByIDs(ids:[%s]){edges{node{title, id}}}" % (",".join(['"%s"' % str(categoryID) for categoryID in options.categoryID]))
+        query = "query($ids:[ID!]!){editorialCategories:editorialCategoriesByIDs(ids:$ids){edges{node{title, id}}}}"
+        variables = {"ids": list(map(str, options.categoryID))}
     else:
-        filter = '(filter:{title:{includes:"%s"}})' % options.categorySearch
-        query = "editorialCategories%s{edges{node{title, id}}}" % filter
-    data = executeQuery(query)["data"]["editorialCategories"]["edges"]
+        query = "query($title:String!){editorialCategories(filter:{title:{includes:$title}}){edges{node{title, id}}}}"
+        variables = {"title": options.categorySearch}
+    data = executeQuery(query, variables)["data"]["editorialCategories"]["edges"]
     for item in data:
         categories.append(AudiothekCategory(item["node"]["id"], item["node"]["title"]))
     return categories
 
 def getProgramSets(options, categoryIDs):
     programSets = []
-    filters = []
-    offset = 0
+    filter = {}
     if len(categoryIDs) > 0:
-        filters.append("editorialCategoryId:{in:[]}" % ",".join(['"%s"' % str(catID) for catID in categoryIDs]))
+        filter["editorialCategoryId"] = {"in": list(map(str, categoryIDs))}
     if options.programSearch is not None:
-        filters.append('title:{likeInsensitive:"%%%s%%"}' % options.programSearch)
-    filter = ""
-    if len(filters) > 0:
-        filter = "filter:{%s}," % ",".join(filters)
-    totalCount = -1
-    while totalCount < 0 or offset + options.pagination <= totalCount:
-        query = "programSets(%s,%s,orderBy:LAST_ITEM_ADDED_DESC){edges{node{title, id, sharingUrl, description, synopsis}}, totalCount}" % (filter, "first:%d,offset:%d" % (options.pagination, offset))
-        data = executeQuery(query)["data"]
-        if totalCount < 0:
-            totalCount = data["programSets"]["totalCount"]
-        for item in data["programSets"]["edges"]:
+        filter["title"] = {"likeInsensitive": "%" + options.programSearch + "%"}
+    query = "query($filter:ProgramSetFilter,$first:Int!,$after:Cursor){programSets(filter:$filter,first:$first,after:$after,orderBy:LAST_ITEM_ADDED_DESC){pageInfo{hasNextPage, endCursor}, edges{node{title, id, sharingUrl, description, synopsis}}}}"
+    limit = options.maxPrograms if options.maxPrograms is not None and options.maxPrograms > 0 else None
+    # follow the page cursor instead of scanning with an offset
+    cursor = None
+    hasNextPage = True
+    while hasNextPage:
+        # do not query more program sets than needed for --max-programs
+        first = options.pagination if limit is None else min(options.pagination, limit - len(programSets))
+        variables = {"filter": filter if len(filter) > 0 else None, "first": first, "after": cursor}
+        data = executeQuery(query, variables)["data"]["programSets"]
+        for item in data["edges"]:
             programSet = AudiothekProgramSet(item["node"]["id"], item["node"]["title"], sharingUrl=item["node"]["sharingUrl"], description=item["node"]["description"], synopsis=item["node"]["synopsis"])
             programSets.append(programSet)
-        offset += options.pagination
+        hasNextPage = data["pageInfo"]["hasNextPage"]
+        cursor = data["pageInfo"]["endCursor"]
+        if limit is not None and len(programSets) >= limit:
+            break
     return programSets
 
 def getProgramSetsByID(options):
-    query = "programSetsByIds(ids:[%s]){nodes{title, id, sharingUrl, description, synopsis}}" % (",".join(['"%s"' % str(showID) for showID in options.programID]))
-    data = executeQuery(query)["data"]["programSetsByIds"]["nodes"]
+    if len(options.programID) == 0:
+        return []
+    # split long ID lists into aliased sub-queries of the same request
+    variables = {}
+    declarations = []
+    selections = []
+    for i, batch in enumerate(splitIntoBatches(options.programID, options.pagination)):
+        variables["ids%d" % i] = list(map(str, batch))
+        declarations.append("$ids%d:[ID!]!" % i)
+        selections.append("ids%d:programSetsByIds(ids:$ids%d){nodes{title, id, sharingUrl, description, synopsis}}" % (i, i))
+    query = "query(" + ",".join(declarations) + "){" + "".join(selections) + "}"
+    data = executeQuery(query, variables)["data"]
     programSets = []
-    for item in data:
-        programSet = AudiothekProgramSet(item["id"], item["title"], sharingUrl=item["sharingUrl"], description=item["description"], synopsis=item["synopsis"])
-        programSets.append(programSet)
+    for alias in sorted(data, key=lambda x:int(x[3:])):
+        for item in data[alias]["nodes"]:
+            programSet = AudiothekProgramSet(item["id"], item["title"], sharingUrl=item["sharingUrl"], description=item["description"], synopsis=item["synopsis"])
+            programSets.append(programSet)
     return programSets
 
-def writeRSS(outputPath, root):
-    tree = ET.ElementTree(root)
-    ET.indent(tree, space="    ", level=0)
-    tree.write(outputPath, encoding="utf-8")
+def writeRSS(outputPath, programSet, pretty=False):
+    # replace the previous file only after the new one has been written completely
+    tempPath = "%s.tmp" % outputPath
+    try:
+        if etree is not None:
+            # stream the elements to the file without building a tree
+            with etree.xmlfile(tempPath, encoding="utf-8") as xf:
+                xf.write_declaration()
+                builder = XMLFileBuilder(xf, pretty=pretty)
+                builder.start('rss', {}, NAMESPACES)
+                programSet.toXML(builder)
+                builder.end('rss')
+        else:
+            builder = ET.TreeBuilder()
+            builder.start('rss', {})
+            programSet.toXML(builder)
+            builder.end('rss')
+            tree = ET.ElementTree(builder.close())
+            if pretty:
+                ET.indent(tree, space="    ", level=0)
+            tree.write(tempPath, encoding="utf-8", xml_declaration=True)
+        os.replace(tempPath, outputPath)
+    finally:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+
+async def queryEpisodesConcurrently(batches, options):
+    # bound the number of requests in flight
+    semaphore = asyncio.Semaphore(options.concurrency)
+    async with aiohttp.ClientSession(headers=API_HEADERS, timeout=aiohttp.ClientTimeout(total=API_TIMEOUT), trust_env=True) as session:
+        async def queryBatch(batch):
+            async with semaphore:
+                await queryEpisodeBatchAsync(session, batch, options)
+        await asyncio.gather(*[queryBatch(batch) for batch in batches])
+
+def queryEpisodes(programSets, options):
+    batches = splitIntoBatches(programSets, options.batchSize)
+    if options.concurrency > 1:
+        # only the requests session can use the response cache
+        if aiohttp is not None and not (options.cache and requests_cache is not None):
+            asyncio.run(queryEpisodesConcurrently(batches, options))
+        else:
+            # fall back to threads sharing the connection pool of the session
+            with ThreadPoolExecutor(max_workers=options.concurrency) as pool:
+                list(pool.map(lambda batch: queryEpisodeBatch(batch, options), batches))
+        return
+    count = 0
+    for batch in batches:
+        queryEpisodeBatch(batch, options)
+        # pause after every 100 programs only, not after the last batch
+        if (count + len(batch)) // 100 > count // 100 and count + len(batch) < len(programSets):
+            sleep(1)
+        count += len(batch)
 
 def queryContent(options):
     # create result var structure
@@ -219,54 +442,39 @@ def main(options):
         os.makedirs(rssDir, exist_ok=True)
     
     # query the content
+    initSession(options)
     limit = -1 if options.maxPrograms is None else options.maxPrograms
-    count = 0
-    stop = False
     jinjaVars = []
     programSets = queryContent(options)
+    if limit > 0:
+        programSets = programSets[:limit]
+    queryEpisodes(programSets, options)
     for programSet in programSets:
-        programSet.queryEpisodes(options)
         if programSet.hasItems():
-            root = ET.Element('rss')
-            contentNode = programSet.toXML()
-            root.append(contentNode)
-            normTitle = unicodedata.normalize("NFKD", programSet.title)
             outputFileName = options.output % ("", int(programSet.id))
             outputPath = os.path.join(rssDir, outputFileName)
-            writeRSS(outputPath, root)
-            jinjaVars.append((os.path.join("..", "rss", outputFileName), normTitle))
+            writeRSS(outputPath, programSet, pretty=options.pretty)
+            jinjaVars.append((os.path.join("..", "rss", outputFileName), programSet.normTitle, html.escape(programSet.initChar)))
             programSet.rssPath = outputPath
             programSet.items = None
             print("Written %d\t%s" % (int(programSet.id), programSet.title))
-        count += 1
-        if limit > 0 and count == limit:
-            stop = True
-        if stop:
-            break
-        if count % 100:
-            sleep(1)
      
     if options.html:
-        # order alphabetically
-        programsByChar = {}
-        for filePath, normTitle in jinjaVars:
-            initChar = normTitle[:1].upper()
-            if initChar not in programsByChar:
-                programsByChar[initChar] = []
-            programsByChar[initChar].append((filePath, normTitle))
-        for initChar in programsByChar:
-            programsByChar[initChar].sort(key=lambda x:x[1])
-        letters = [("#%s" % html.escape(initChar.upper()), html.escape(initChar.upper())) for initChar in programsByChar]
-        letters.sort(key=lambda x:x[1])
+        # order alphabetically by escaped initial character and title in a single pass
+        jinjaVars.sort(key=lambda x:(x[2], x[1]))
         orderedData = []
-        for initChar, programSets in programsByChar.items():
-            orderedData.append((html.escape(initChar.upper()), programSets))
-        orderedData.sort(key=lambda x:x[0])
+        letters = []
+        for escapedChar, programSets in itertools.groupby(jinjaVars, key=lambda x:x[2]):
+            orderedData.append((escapedChar, [(filePath, normTitle) for filePath, normTitle, _ in programSets]))
+            letters.append(("#%s" % escapedChar, escapedChar))
         
         # read template
-        from jinja2 import Environment, FileSystemLoader
+        from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
         templateDir = os.path.join(getScriptDirectory(), 'templates', 'standardissue')
-        env = Environment(loader = FileSystemLoader(templateDir))
+        # keep the compiled template in the temp directory for repeated runs
+        env = Environment(loader = FileSystemLoader(templateDir), 
+                          bytecode_cache = FileSystemBytecodeCache(), 
+                          auto_reload = False)
         template = env.get_template('index.jinja')
         htmlSource = template.render(orderedData = orderedData, 
                                      letters = letters, 
@@ -291,8 +499,12 @@ def getOptions(args=None):
     argParser.add_argument("--program-search", dest="programSearch", type=str, help="Audiothek program search term")
     argParser.add_argument("--max-programs", dest="maxPrograms", type=int, help="Print the first n programs")
     argParser.add_argument("--pagination", type=int, default=100, help="Query at most this number of datasets at once")
+    argParser.add_argument("--concurrency", type=int, default=4, help="Send at most this number of API queries at once (1 disables concurrent queries)")
+    argParser.add_argument("--batch-size", dest="batchSize", type=int, default=10, help="Query the episodes of this number of programs in a single request")
     argParser.add_argument("--latest", type=int, default=10, help="Return only the last n items per program")
+    argParser.add_argument("--no-cache", dest="cache", action="store_false", default=True, help="do not use cached API responses (requires requests_cache)")
     argParser.add_argument("--html", action="store_true", default=False, help="create HTML overview of found items")
+    argParser.add_argument("--pretty", action="store_true", default=False, help="indent the RSS files for better readability")
     argParser.add_argument("-d", "--directory", dest="outputDir", type=str, default="rss", help="base directory for HTML and RSS output files")
     argParser.add_argument("-o", "--output", dest="output", type=str, default="ardaudiothek_%s%d.rss", help="output RSS file name template")
     options = argParser.parse_args(args=args)
@@ -300,6 +512,10 @@ def getOptions(args=None):
     # value checks
     if not os.path.exists(options.outputDir):
         sys.exit("The output directory %s does not exist" % options.outputDir)
+    if options.concurrency < 1:
+        sys.exit("The --concurrency value has to be at least 1")
+    if options.batchSize < 1:
+        sys.exit("The --batch-size value has to be at least 1")
     
     if options.programID is not None and (options.programSearch is not None or options.categoryID is not None):
         print("The --program-id argument overrides eventual restrictions by --program-search and --category-id.")